@@ -4,41 +4,54 @@
 #  python client.py "Book a meeting with John tomorrow at 10"
 #  python client.py "Show my events on 2025-10-22"
 
+import re
 import sys
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from datetime import datetime, timedelta
 from llm import generate
 
 SERVER = "http://localhost:8000/jsonrpc"
 
+# one keep-alive session for all calls instead of a new TCP connection per request
+_SESSION = requests.Session()
+_SESSION.headers["Content-Type"] = "application/json"
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=Retry(total=2, backoff_factor=0.1))
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+_DUR_RE = re.compile(r"(\d+)\s*min")
+
+def _find_date(s):
+    """Return the first YYYY-MM-DD substring of s, or None (a direct scan, no regex)."""
+    for i in range(len(s) - 9):
+        if s[i+4] == "-" and s[i+7] == "-" and s[i:i+4].isdigit() and s[i+5:i+7].isdigit() and s[i+8:i+10].isdigit():
+            return s[i:i+10]
+    return None
+
 def jsonrpc_call(method, params, id=1):
     payload = {"jsonrpc":"2.0","method":method,"params":params,"id":id}
-    r = requests.post(SERVER, json=payload, timeout=10)
+    r = _SESSION.post(SERVER, json=payload, timeout=10)
     return r.json()
 
 def find_free_and_book(day_iso, duration_minutes, title="Meeting via MCP", attendees=None):
-    print("→ asking server to find free slot")
-    r = jsonrpc_call("find_free_slot", {"day": day_iso, "duration_minutes": duration_minutes}, id=1)
+    print("→ asking server to find a free slot and book it")
+    # single round trip: the server finds the slot and creates the event
+    r = jsonrpc_call("find_and_create", {
+        "day": day_iso,
+        "duration_minutes": duration_minutes,
+        "title": title,
+        "attendees": attendees or []
+    }, id=1)
     if "error" in r:
         print("Server error:", r["error"])
         return
-    slot = r.get("result")
-    if not slot:
+    ev = r.get("result")
+    if not ev:
         print("No free slot found that day.")
         return
-    print("Found slot:", slot)
-    # create event
-    create = jsonrpc_call("create_event", {
-        "title": title,
-        "start": slot["start"],
-        "end": slot["end"],
-        "attendees": attendees or []
-    }, id=2)
-    if "error" in create:
-        print("Create error:", create["error"])
-        return
-    ev = create.get("result")
     print("Event created:", ev)
     # ask LLM to produce confirmation text
     prompt = f"You scheduled an event titled '{title}' from {ev['start']} to {ev['end']} with attendees {ev['attendees']}. Produce a short friendly confirmation message."
@@ -65,26 +78,21 @@ def main(argv):
     if "free" in cmd or "find" in cmd:
         # Basic parse: look for date in YYYY-MM-DD or use tomorrow
         # This is a demo; parsing is naive
-        import re
-        m = re.search(r"(\d{4}-\d{2}-\d{2})", cmd)
-        if m:
-            day = m.group(1)
-        elif "tomorrow" in cmd:
+        day = _find_date(cmd)
+        if day is None and "tomorrow" in cmd:
             day = (datetime.utcnow().date() + timedelta(days=1)).isoformat()
-        else:
+        elif day is None:
             day = datetime.utcnow().date().isoformat()
         # duration
         dur = 60
-        dm = re.search(r"(\d+)\s*min", cmd)
+        dm = _DUR_RE.search(cmd)
         if dm:
             dur = int(dm.group(1))
         find_free_and_book(day, dur, title="Quick MCP Booking")
     elif "book" in cmd or "schedule" in cmd:
         # naive: assume "book ... on YYYY-MM-DD" or tomorrow 10:00
-        import re
-        m = re.search(r"(\d{4}-\d{2}-\d{2})", cmd)
-        if m:
-            day = m.group(1)
+        day = _find_date(cmd)
+        if day:
             # find a free slot and book
             find_free_and_book(day, 60, title="Booked by user request")
         elif "tomorrow" in cmd:
@@ -93,10 +101,9 @@ def main(argv):
         else:
             print("Could not parse booking date; try including YYYY-MM-DD or 'tomorrow'.")
     elif "show" in cmd or "events" in cmd:
-        import re
-        m = re.search(r"(\d{4}-\d{2}-\d{2})", cmd)
-        if m:
-            show_events(m.group(1))
+        day = _find_date(cmd)
+        if day:
+            show_events(day)
         else:
             # default to today
             show_events(datetime.utcnow().date().isoformat())
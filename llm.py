@@ -6,53 +6,226 @@
 # If no key is set or any network error occurs, falls back to mock LLM.
 
 import os
-import requests
+import asyncio
+import hashlib
+import httpx
 import json
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional
 
 # Hardcoded correct OpenRouter endpoint
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY")
 
-def generate(prompt: str, max_tokens: int = 256) -> str:
-    """
-    Calls OpenRouter API if API key exists.
-    Falls back to a mock LLM response if key missing or call fails.
-    """
-    if not OPENROUTER_KEY:
-        snippet = prompt[:400].replace("\n", " ")
-        return f"[MOCK LLM]\nBased on context: {snippet}\n\nReply: (mock) I scheduled your meeting successfully."
+# shared, connection-pooled client so concurrent requests reuse keep-alive connections
+_client = httpx.AsyncClient(
+    timeout=30,
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+)
+
+# in-process LRU of upstream replies; prompts are hashed so long ones don't bloat the keys
+_CACHE_MAX = 1024
+_cache: "OrderedDict[str, str]" = OrderedDict()
+
+def _cache_key(prompt: str, max_tokens: int) -> str:
+    return hashlib.blake2b(f"{max_tokens}:{prompt}".encode(), digest_size=16).hexdigest()
+
+def _cache_put(key: str, text: str) -> None:
+    _cache[key] = text
+    _cache.move_to_end(key)
+    if len(_cache) > _CACHE_MAX:
+        _cache.popitem(last=False)
+
+def _cache_get(key: str) -> Optional[str]:
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache.move_to_end(key)
+    return cached
+
+# upstream calls currently in flight, by cache key: identical concurrent prompts await the
+# same result instead of each paying for an OpenRouter call (single-flight). Resolves to
+# None if the leading stream failed or was abandoned, in which case waiters make their own call.
+_inflight: Dict[str, "asyncio.Future[Optional[str]]"] = {}
 
-    headers = {
+def _forget_inflight(key: str, task: "asyncio.Future[Optional[str]]") -> None:
+    _inflight.pop(key, None)
+    # mark the exception retrieved even if every waiter was cancelled, so asyncio doesn't
+    # log "Task exception was never retrieved"; waiters awaiting it still see it raised
+    if not task.cancelled():
+        task.exception()
+
+def _mock_reply(prompt: str) -> str:
+    snippet = prompt[:400].replace("\n", " ")
+    return f"[MOCK LLM]\nBased on context: {snippet}\n\nReply: (mock) I scheduled your meeting successfully."
+
+def _fallback_reply(prompt: str) -> str:
+    snippet = prompt[:400].replace("\n", " ")
+    return f"[MOCK LLM - fallback]\nBased on context: {snippet}\n\nReply: (mock fallback) Meeting scheduled."
+
+def _headers() -> dict:
+    return {
         "Authorization": f"Bearer {OPENROUTER_KEY}",
         "Content-Type": "application/json",
         # Optional but recommended header
-        "HTTP-Referer": "https://openrouter.ai", 
+        "HTTP-Referer": "https://openrouter.ai",
         "X-Title": "Calendar MCP Demo"
     }
 
-    payload = {
-        "model": "meta-llama/llama-3-8b-instruct", 
+def _payload(prompt: str, max_tokens: int, stream: bool = False) -> dict:
+    return {
+        "model": "meta-llama/llama-3-8b-instruct",
         "messages": [{"role": "user", "content": prompt}],
         "max_tokens": max_tokens,
-        "temperature": 0.2
+        "temperature": 0.2,
+        "stream": stream
     }
 
+async def agenerate(prompt: str, max_tokens: int = 256, client: Optional[httpx.AsyncClient] = None) -> str:
+    """
+    Calls OpenRouter API if API key exists, without blocking the event loop.
+    Uses the shared client unless `client` is given (see generate()).
+    Successful replies are cached per (prompt, max_tokens).
+    Falls back to a mock LLM response if key missing or call fails.
+    """
+    if not OPENROUTER_KEY:
+        return _mock_reply(prompt)
+
+    key = _cache_key(prompt, max_tokens)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    pending = _inflight.get(key)
+    if pending is None:
+        # run the call as its own task so a cancelled caller doesn't cancel it for the others
+        pending = asyncio.ensure_future(_post(prompt, max_tokens, key, client or _client))
+        _inflight[key] = pending
+        pending.add_done_callback(lambda t: _forget_inflight(key, t))
+    text = await asyncio.shield(pending)
+    if text is None:
+        return await agenerate(prompt, max_tokens, client)
+    return text
+
+async def _post(prompt: str, max_tokens: int, key: str, client: httpx.AsyncClient) -> str:
     try:
-        resp = requests.post(OPENROUTER_URL, headers=headers, json=payload, timeout=30)
+        resp = await client.post(OPENROUTER_URL, headers=_headers(), json=_payload(prompt, max_tokens))
         resp.raise_for_status()
         data = resp.json()
 
         if "choices" in data and len(data["choices"]) > 0:
             choice = data["choices"][0]
             if "message" in choice and "content" in choice["message"]:
-                return choice["message"]["content"].strip()
+                text = choice["message"]["content"].strip()
+                _cache_put(key, text)
+                return text
             elif "text" in choice:
-                return choice["text"].strip()
+                text = choice["text"].strip()
+                _cache_put(key, text)
+                return text
 
         return json.dumps(data, indent=2)[:1000]
 
-    except requests.exceptions.RequestException as e:
+    # ValueError covers a 200 with a non-JSON body (e.g. a proxy's HTML error page)
+    except (httpx.HTTPError, ValueError) as e:
         print("⚠️  Network or API error:", e)
-        snippet = prompt[:400].replace("\n", " ")
-        return f"[MOCK LLM - fallback]\nBased on context: {snippet}\n\nReply: (mock fallback) Meeting scheduled."
+        return _fallback_reply(prompt)
+
+class LLMStreamError(Exception):
+    """The upstream stream broke after some deltas were already yielded."""
+
+def _stream_delta(data: str) -> Optional[str]:
+    """Content delta of one SSE `data:` payload; ValueError if it's an error or malformed chunk."""
+    chunk = json.loads(data)
+    # OpenRouter reports mid-stream failures as {"error": {...}} chunks
+    if not isinstance(chunk, dict) or "error" in chunk:
+        raise ValueError(f"bad stream chunk: {data[:200]}")
+    choices = chunk.get("choices") or []
+    if not choices:
+        return None
+    choice = choices[0]
+    delta = choice.get("delta") if isinstance(choice, dict) else None
+    content = delta.get("content") if isinstance(delta, dict) else None
+    return content if isinstance(content, str) else None
+
+async def agenerate_stream(prompt: str, max_tokens: int = 256) -> AsyncIterator[str]:
+    """
+    Streaming variant of agenerate(): yields the reply as text deltas while OpenRouter
+    produces them (server-sent events). Cache hits and mock/fallback replies arrive as
+    a single chunk; a completed stream is stored in the same cache as agenerate().
+    A stream that fails, or ends, before any content yields the fallback reply; one that
+    fails part-way raises LLMStreamError, so callers can tell a truncated reply from a
+    complete one.
+    """
+    if not OPENROUTER_KEY:
+        yield _mock_reply(prompt)
+        return
+
+    key = _cache_key(prompt, max_tokens)
+    cached = _cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        text = await asyncio.shield(pending)
+        if text is None:
+            async for delta in agenerate_stream(prompt, max_tokens):
+                yield delta
+        else:
+            yield text
+        return
+
+    done = asyncio.get_running_loop().create_future()
+    _inflight[key] = done
+    parts = []
+    text = None
+    try:
+        async with _client.stream("POST", OPENROUTER_URL, headers=_headers(), json=_payload(prompt, max_tokens, stream=True)) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                # skip blank separators and ": keep-alive" comment lines
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                delta = _stream_delta(data)
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+        if parts:
+            text = "".join(parts).strip()
+            _cache_put(key, text)
+        else:
+            # a 200 that carried no usable deltas (e.g. a proxy's HTML page)
+            print("⚠️  LLM stream returned no content")
+            yield _fallback_reply(prompt)
+
+    except (httpx.HTTPError, ValueError) as e:
+        print("⚠️  Network or API error:", e)
+        if parts:
+            raise LLMStreamError(f"LLM stream interrupted: {e}") from e
+        yield _fallback_reply(prompt)
+
+    finally:
+        # also runs if the consumer stops early; waiters then retry on their own
+        _inflight.pop(key, None)
+        done.set_result(text)
+
+def generate(prompt: str, max_tokens: int = 256) -> str:
+    """
+    Blocking wrapper around agenerate() for scripts without an event loop (client.py).
+    Each call gets its own short-lived client: the shared one's pooled connections are
+    bound to the loop they were opened on, and asyncio.run() closes its loop on exit.
+    """
+    async def run() -> str:
+        async with httpx.AsyncClient(timeout=30) as client:
+            return await agenerate(prompt, max_tokens, client)
+    return asyncio.run(run())
 
+async def aclose() -> None:
+    """Close the shared HTTP client (call on app shutdown)."""
+    await _client.aclose()
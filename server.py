@@ -1,29 +1,38 @@
 # server.py
 # MCP Calendar Server with a tiny web UI served from / (static/index.html)
-# and a helper endpoint /api/book_and_confirm to find+create an event and return an LLM confirmation.
+# and a helper endpoint /api/book_and_confirm to find+create an event and stream an LLM confirmation.
 #
 # Run: uvicorn server:app --reload --port 8000
 
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import Any, Dict, List
-from datetime import datetime, timedelta
-import uuid
-import json
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, time, timedelta
+from dataclasses import dataclass, field
+from functools import lru_cache
+import asyncio
+import bisect
+from secrets import token_hex
+import orjson
 import os
 
 # import the llm wrapper you already have (it will use OPENROUTER_API_KEY if set)
-from llm import generate as llm_generate
+from llm import agenerate_stream as llm_agenerate_stream, aclose as llm_aclose, LLMStreamError
 
-app = FastAPI(title="MCP Calendar Server (demo with UI)")
+app = FastAPI(title="MCP Calendar Server (demo with UI)", default_response_class=ORJSONResponse)
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_aclose()
 
 # serve static files from ./static (index.html)
 # make sure to create a folder named "static" next to this file and put index.html inside
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 INDEX_FILE = os.path.join(STATIC_DIR, "index.html")
+# checked once at startup rather than with a stat() on every / request
+_INDEX_EXISTS = os.path.isfile(INDEX_FILE)
 
 if os.path.isdir(STATIC_DIR):
     app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
@@ -32,106 +41,216 @@ else:
 
 @app.get("/", response_class=FileResponse)
 def read_index():
-    if os.path.isfile(INDEX_FILE):
+    if _INDEX_EXISTS:
         return INDEX_FILE
     raise HTTPException(status_code=404, detail="Index not found")
 
-# In-memory calendar events (demo)
-EVENTS: List[Dict[str, Any]] = [
-    {
-        "id": "e1",
-        "title": "Weekly team sync",
-        "start": "2025-10-22T10:00:00",
-        "end": "2025-10-22T10:30:00",
-        "attendees": ["alice@example.com"],
-        "created_by": "system"
-    },
-    {
-        "id": "e2",
-        "title": "Project planning",
-        "start": "2025-10-22T15:00:00",
-        "end": "2025-10-22T16:00:00",
-        "attendees": ["bob@example.com"],
-        "created_by": "system"
-    }
-]
-
-class JSONRPCRequest(BaseModel):
-    jsonrpc: str
-    method: str
-    params: Dict[str, Any] = {}
-    id: Any = None
-
+# ISO strings are immutable and the same day/slot strings recur across requests
+@lru_cache(maxsize=4096)
 def parse_iso(s: str) -> datetime:
     return datetime.fromisoformat(s)
 
 def iso(dt: datetime) -> str:
     return dt.isoformat(timespec='seconds')
 
-@app.post("/jsonrpc")
-async def jsonrpc(req: Request):
-    body = await req.json()
-    try:
-        rpc = JSONRPCRequest(**body)
-    except Exception as e:
-        return {"jsonrpc":"2.0","error":{"code":-32600,"message":"Invalid Request","data":str(e)},"id":None}
+@dataclass
+class Event:
+    id: str
+    title: str
+    start: datetime
+    end: datetime
+    attendees: List[str] = field(default_factory=list)
+    created_by: str = "client"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable form used in responses (ISO strings for start/end)."""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "start": iso(self.start),
+            "end": iso(self.end),
+            "attendees": self.attendees,
+            "created_by": self.created_by
+        }
+
+# In-memory calendar events (demo), kept sorted by start so any time window is a
+# contiguous slice located with two bisects; no parsing, filtering or sorting per query.
+# _STARTS/_ENDS are column copies kept index-aligned with EVENTS: bisects compare plain
+# datetimes (no key function) and the free-slot scan never touches the Event objects.
+EVENTS: List[Event] = []
+_STARTS: List[datetime] = []
+_ENDS: List[datetime] = []
+# bumped on every write; it is part of the free-slot cache key, so answers computed for an
+# older calendar are never served again (they just age out of the LRU)
+EVENTS_VERSION = 0
+
+def new_event_id() -> str:
+    # 64 random bits straight to hex: no UUID formatting/slicing, and collisions stay
+    # negligible long after an 8-char (32-bit) id would start repeating
+    return token_hex(8)
+
+def add_event(ev: Event) -> None:
+    global EVENTS_VERSION
+    i = bisect.bisect_right(_STARTS, ev.start)
+    EVENTS.insert(i, ev)
+    _STARTS.insert(i, ev.start)
+    _ENDS.insert(i, ev.end)
+    EVENTS_VERSION += 1
+
+def _index_range(lo: datetime, hi: datetime) -> Tuple[int, int]:
+    return bisect.bisect_left(_STARTS, lo), bisect.bisect_left(_STARTS, hi)
+
+def events_between(lo: datetime, hi: datetime) -> List[Event]:
+    """Events starting in [lo, hi), in start order."""
+    i, j = _index_range(lo, hi)
+    return EVENTS[i:j]
+
+# working hours searched by find_free_slot
+WORK_START = time(9)
+WORK_END = time(17)
+
+def _first_gap(starts: List[datetime], ends: List[datetime], i: int, j: int,
+               work_start: datetime, work_end: datetime, duration: timedelta) -> Optional[datetime]:
+    """
+    Walk the sorted intervals starts[i:j]/ends[i:j] and return the start of the first gap
+    of at least `duration` inside [work_start, work_end], or None. Every start in the range
+    must be before work_end, so any gap found before an event also ends by work_end.
+    """
+    cursor = work_start
+    for k in range(i, j):
+        if starts[k] - cursor >= duration:
+            return cursor
+        if ends[k] > cursor:
+            cursor = ends[k]
+    if work_end - cursor >= duration:
+        return cursor
+    return None
+
+@lru_cache(maxsize=256)
+def _free_slot_cached(version: int, day: str, duration_minutes: int) -> Optional[Tuple[datetime, datetime]]:
+    d = parse_iso(day)
+    work_start = datetime.combine(d.date(), WORK_START, d.tzinfo)
+    work_end = datetime.combine(d.date(), WORK_END, d.tzinfo)
+    duration = timedelta(minutes=duration_minutes)
+    # events from midnight can still run into working hours; ones starting at/after
+    # work_end can't affect a slot, so the scan stops there
+    i, j = _index_range(datetime.combine(d.date(), time(), d.tzinfo), work_end)
+    start = _first_gap(_STARTS, _ENDS, i, j, work_start, work_end, duration)
+    if start is None:
+        return None
+    return start, start + duration
+
+def _find_free_slot(day: str, duration_minutes: int) -> Optional[Tuple[datetime, datetime]]:
+    """
+    First (start, end) gap of duration_minutes between 09:00 and 17:00 on day, or None.
+    Answers are cached per EVENTS_VERSION, so repeated probes are O(1) until the next write.
+    """
+    return _free_slot_cached(EVENTS_VERSION, day, duration_minutes)
+
+for _ev in (
+    Event(
+        id="e1",
+        title="Weekly team sync",
+        start=parse_iso("2025-10-22T10:00:00"),
+        end=parse_iso("2025-10-22T10:30:00"),
+        attendees=["alice@example.com"],
+        created_by="system"
+    ),
+    Event(
+        id="e2",
+        title="Project planning",
+        start=parse_iso("2025-10-22T15:00:00"),
+        end=parse_iso("2025-10-22T16:00:00"),
+        attendees=["bob@example.com"],
+        created_by="system"
+    ),
+):
+    add_event(_ev)
+
+async def _dispatch(body: Any) -> Dict[str, Any]:
+    """Validate and execute a single JSON-RPC request object, returning its response object."""
+    # hand-rolled checks: a pydantic model per call costs more than most methods' actual work
+    if not isinstance(body, dict) or body.get("jsonrpc") != "2.0" or not isinstance(body.get("method"), str):
+        return {"jsonrpc":"2.0","error":{"code":-32600,"message":"Invalid Request","data":"Expected an object with jsonrpc '2.0' and a string method"},"id":None}
+    method = body["method"]
+    params = body.get("params", {})
+    rpc_id = body.get("id")
+    if not isinstance(params, dict):
+        return {"jsonrpc":"2.0","error":{"code":-32600,"message":"Invalid Request","data":"params must be an object"},"id":rpc_id}
 
     try:
-        if rpc.method == "list_events":
-            return {"jsonrpc":"2.0","result": EVENTS, "id": rpc.id}
+        if method == "list_events":
+            return {"jsonrpc":"2.0","result": [e.to_dict() for e in EVENTS], "id": rpc_id}
 
-        elif rpc.method == "get_events_for_day":
-            day = rpc.params.get("day")
+        elif method == "get_events_for_day":
+            day = params.get("day")
             if not day:
-                return {"jsonrpc":"2.0","error":{"code":-32602,"message":"Missing param 'day'"},"id":rpc.id}
-            start_day = datetime.fromisoformat(day)
-            end_day = start_day + timedelta(days=1)
-            matches = [e for e in EVENTS if (parse_iso(e["start"]) >= start_day and parse_iso(e["start"]) < end_day)]
-            return {"jsonrpc":"2.0","result": matches, "id": rpc.id}
-
-        elif rpc.method == "find_free_slot":
-            day = rpc.params.get("day")
-            duration = int(rpc.params.get("duration_minutes", 60))
+                return {"jsonrpc":"2.0","error":{"code":-32602,"message":"Missing param 'day'"},"id":rpc_id}
+            start_day = parse_iso(day)
+            matches = events_between(start_day, start_day + timedelta(days=1))
+            return {"jsonrpc":"2.0","result": [e.to_dict() for e in matches], "id": rpc_id}
+
+        elif method == "find_free_slot":
+            day = params.get("day")
+            duration = int(params.get("duration_minutes", 60))
             if not day:
-                return {"jsonrpc":"2.0","error":{"code":-32602,"message":"Missing param 'day'"},"id":rpc.id}
-            work_start = datetime.fromisoformat(day).replace(hour=9, minute=0, second=0)
-            work_end = work_start.replace(hour=17)
-            slot = None
-            evs = sorted([e for e in EVENTS if parse_iso(e["start"]).date() == work_start.date()], key=lambda x: x["start"])
-            cursor = work_start
-            for e in evs:
-                s = parse_iso(e["start"])
-                if (s - cursor).total_seconds() >= duration*60:
-                    slot = {"start": iso(cursor), "end": iso(cursor + timedelta(minutes=duration))}
-                    break
-                cursor = max(cursor, parse_iso(e["end"]))
-            if slot is None and (work_end - cursor).total_seconds() >= duration*60:
-                slot = {"start": iso(cursor), "end": iso(cursor + timedelta(minutes=duration))}
-            return {"jsonrpc":"2.0","result": slot, "id": rpc.id}
-
-        elif rpc.method == "create_event":
-            title = rpc.params.get("title")
-            start = rpc.params.get("start")
-            end = rpc.params.get("end")
-            attendees = rpc.params.get("attendees", [])
+                return {"jsonrpc":"2.0","error":{"code":-32602,"message":"Missing param 'day'"},"id":rpc_id}
+            found = _find_free_slot(day, duration)
+            slot = {"start": iso(found[0]), "end": iso(found[1])} if found else None
+            return {"jsonrpc":"2.0","result": slot, "id": rpc_id}
+
+        elif method == "create_event":
+            title = params.get("title")
+            start = params.get("start")
+            end = params.get("end")
+            attendees = params.get("attendees", [])
             if not (title and start and end):
-                return {"jsonrpc":"2.0","error":{"code":-32602,"message":"Missing title/start/end"},"id":rpc.id}
-            new_e = {
-                "id": str(uuid.uuid4())[:8],
-                "title": title,
-                "start": start,
-                "end": end,
-                "attendees": attendees,
-                "created_by": rpc.params.get("created_by","client")
-            }
-            EVENTS.append(new_e)
-            return {"jsonrpc":"2.0","result": new_e, "id": rpc.id}
+                return {"jsonrpc":"2.0","error":{"code":-32602,"message":"Missing title/start/end"},"id":rpc_id}
+            # EVENTS is bisected on start, so every stored datetime must be comparable:
+            # the calendar holds naive local times only
+            try:
+                start_dt, end_dt = parse_iso(start), parse_iso(end)
+            except (TypeError, ValueError):
+                return {"jsonrpc":"2.0","error":{"code":-32602,"message":"start/end must be ISO datetimes"},"id":rpc_id}
+            if start_dt.tzinfo is not None or end_dt.tzinfo is not None:
+                return {"jsonrpc":"2.0","error":{"code":-32602,"message":"start/end must be naive local ISO datetimes (no UTC offset or 'Z')"},"id":rpc_id}
+            new_e = Event(
+                id=new_event_id(),
+                title=title,
+                start=start_dt,
+                end=end_dt,
+                attendees=attendees,
+                created_by=params.get("created_by","client")
+            )
+            add_event(new_e)
+            return {"jsonrpc":"2.0","result": new_e.to_dict(), "id": rpc_id}
+
+        elif method == "find_and_create":
+            # find_free_slot + create_event in one call, so clients don't need a second round trip
+            found = await _dispatch({"jsonrpc":"2.0","method":"find_free_slot","params":params,"id":rpc_id})
+            slot = found.get("result")
+            if not slot:
+                return found
+            return await _dispatch({"jsonrpc":"2.0","method":"create_event","params":{**params, **slot},"id":rpc_id})
 
         else:
-            return {"jsonrpc":"2.0","error":{"code":-32601,"message":"Method not found"},"id":rpc.id}
+            return {"jsonrpc":"2.0","error":{"code":-32601,"message":"Method not found"},"id":rpc_id}
 
     except Exception as e:
-        return {"jsonrpc":"2.0","error":{"code":-32000,"message":"Server error","data":str(e)},"id":rpc.id}
+        return {"jsonrpc":"2.0","error":{"code":-32000,"message":"Server error","data":str(e)},"id":rpc_id}
+
+@app.post("/jsonrpc")
+async def jsonrpc(req: Request):
+    try:
+        body = orjson.loads(await req.body())
+    except orjson.JSONDecodeError as e:
+        return {"jsonrpc":"2.0","error":{"code":-32700,"message":"Parse error","data":str(e)},"id":None}
+    # JSON-RPC 2.0 batch: an array of request objects gets an array of responses
+    if isinstance(body, list):
+        if not body:
+            return {"jsonrpc":"2.0","error":{"code":-32600,"message":"Invalid Request","data":"Empty batch"},"id":None}
+        return await asyncio.gather(*(_dispatch(item) for item in body))
+    return await _dispatch(body)
 
 
 # -------------------------
@@ -145,45 +264,47 @@ class BookRequest(PydanticBaseModel):
     title: str = "Booked via UI"
     attendees: List[str] = []
 
+def _sse(data: Any) -> bytes:
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
 @app.post("/api/book_and_confirm")
 async def book_and_confirm(req: BookRequest):
     """
-    Helper endpoint: finds a free slot, creates the event, then asks llm_generate()
-    for a human-friendly confirmation message and returns both event + confirmation.
+    Helper endpoint: finds a free slot, creates the event, then streams it back as
+    server-sent events: first `{"event": ...}`, then `{"delta": ...}` chunks of the
+    llm_agenerate_stream() confirmation as they arrive, then `{"done": true}` -- or
+    `{"error": ...}` instead if the LLM stream broke part-way.
     """
     day = req.day
     duration = req.duration_minutes
-    # 1) find slot (reuse same logic as JSON-RPC method)
-    work_start = datetime.fromisoformat(day).replace(hour=9, minute=0, second=0)
-    work_end = work_start.replace(hour=17)
-    slot = None
-    evs = sorted([e for e in EVENTS if parse_iso(e["start"]).date() == work_start.date()], key=lambda x: x["start"])
-    cursor = work_start
-    for e in evs:
-        s = parse_iso(e["start"])
-        if (s - cursor).total_seconds() >= duration*60:
-            slot = {"start": iso(cursor), "end": iso(cursor + timedelta(minutes=duration))}
-            break
-        cursor = max(cursor, parse_iso(e["end"]))
-    if slot is None and (work_end - cursor).total_seconds() >= duration*60:
-        slot = {"start": iso(cursor), "end": iso(cursor + timedelta(minutes=duration))}
-
+    # 1) find slot (same logic as JSON-RPC method)
+    slot = _find_free_slot(day, duration)
     if not slot:
         raise HTTPException(status_code=404, detail="No free slot found")
 
     # 2) create event
-    new_e = {
-        "id": str(uuid.uuid4())[:8],
-        "title": req.title,
-        "start": slot["start"],
-        "end": slot["end"],
-        "attendees": req.attendees or [],
-        "created_by": "ui"
-    }
-    EVENTS.append(new_e)
+    ev = Event(
+        id=new_event_id(),
+        title=req.title,
+        start=slot[0],
+        end=slot[1],
+        attendees=req.attendees or [],
+        created_by="ui"
+    )
+    add_event(ev)
+    new_e = ev.to_dict()
 
     # 3) ask LLM to produce a confirmation message
     prompt = f"You scheduled an event titled '{new_e['title']}' from {new_e['start']} to {new_e['end']} with attendees {new_e['attendees']}. Produce a short friendly confirmation message."
-    confirmation = llm_generate(prompt)
 
-    return {"event": new_e, "confirmation": confirmation}
+    async def sse():
+        yield _sse({"event": new_e})
+        try:
+            async for delta in llm_agenerate_stream(prompt):
+                yield _sse({"delta": delta})
+        except LLMStreamError as e:
+            yield _sse({"error": str(e)})
+            return
+        yield _sse({"done": True})
+
+    return StreamingResponse(sse(), media_type="text/event-stream")